@@ -1,47 +1,235 @@
 #!/usr/bin/env python3
-"""Generate chess sound effects as MP3 files. All output is CC0/public domain."""
+"""Generate chess sound effects as MP3 files. All output is CC0/public domain.
 
+Requirements: numpy, scipy, numba, numexpr and av (PyAV, whose wheels bundle the
+libmp3lame encoder, so no separate ffmpeg install is needed):
+
+    pip install numpy scipy numba numexpr av
+"""
+
+import math
+import av
 import numpy as np
-from scipy.io import wavfile
-import subprocess
+import numexpr as ne
+from numba import njit
+from scipy.signal import sosfilt
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from fractions import Fraction
 import os
 
 SAMPLE_RATE = 44100
 OUTPUT_DIR = "/home/ian/chess/webApp/src/jsMain/resources/audio"
 
+# One cycle of a sine wave; tones index into it instead of calling sin per sample
+SINE_LUT_SIZE = 16384
+_SINE_LUT = np.sin(2 * np.pi * np.arange(SINE_LUT_SIZE) / SINE_LUT_SIZE).astype(np.float32)
+
+def _resonant_lowpass(cutoff, q):
+    """2-pole lowpass (RBJ cookbook) as one SOS row; q above 0.707 adds a peak at cutoff."""
+    w0 = 2 * np.pi * cutoff / SAMPLE_RATE
+    alpha = np.sin(w0) / (2 * q)
+    cw = np.cos(w0)
+    b = [(1 - cw) / 2, 1 - cw, (1 - cw) / 2]
+    a = [1 + alpha, -2 * cw, 1 - alpha]
+    return np.array([b + a]) / a[0]
+
+# Pad voice filter: a leaky integrator turns a zero-mean impulse train into a
+# sawtooth (harmonics falling as 1/n), then a resonant lowpass rounds off the top
+# and adds a soft formant around 1.2 kHz
+_PAD_SOS = np.vstack([[1, 0, 0, 1, -0.995, 0], _resonant_lowpass(1200, 2.0)])
+
 def normalize(signal, peak=0.8):
-    mx = np.max(np.abs(signal))
+    # Two reductions find the peak without materializing abs(signal); scaling is in place
+    mx = max(signal.max(), -signal.min())
     if mx > 0:
-        signal = signal * (peak / mx)
+        signal *= peak / mx
     return signal
 
+_RAMP_CACHE = {}
+
+def _ramp(n, up):
+    """Linear 0→1 (or 1→0) ramp of n samples, shared by calls of the same length."""
+    key = (n, up)
+    r = _RAMP_CACHE.get(key)
+    if r is None:
+        r = np.arange(n, dtype=np.float32) * np.float32(1.0 / max(n - 1, 1))
+        if not up:
+            r = 1 - r
+        _RAMP_CACHE[key] = r
+    return r
+
 def fade(signal, fade_in_ms=5, fade_out_ms=50):
     fade_in = int(SAMPLE_RATE * fade_in_ms / 1000)
     fade_out = int(SAMPLE_RATE * fade_out_ms / 1000)
     if fade_in > 0 and fade_in < len(signal):
-        signal[:fade_in] *= np.linspace(0, 1, fade_in)
+        np.multiply(signal[:fade_in], _ramp(fade_in, True), out=signal[:fade_in])
     if fade_out > 0 and fade_out < len(signal):
-        signal[-fade_out:] *= np.linspace(1, 0, fade_out)
+        np.multiply(signal[-fade_out:], _ramp(fade_out, False), out=signal[-fade_out:])
     return signal
 
+class _Mp3Writer:
+    """Encodes mono int16 PCM to an MP3 file in-process with libmp3lame."""
+
+    def __init__(self, path, bit_rate=128000):
+        self.container = av.open(path, "w", format="mp3")
+        self.stream = self.container.add_stream("libmp3lame", rate=SAMPLE_RATE,
+                                                layout="mono")
+        self.stream.bit_rate = bit_rate
+        self.pts = 0
+
+    def write(self, data):
+        frame = av.AudioFrame.from_ndarray(data.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = SAMPLE_RATE
+        frame.time_base = Fraction(1, SAMPLE_RATE)
+        frame.pts = self.pts
+        self.pts += len(data)
+        self.container.mux(self.stream.encode(frame))
+
+    def close(self):
+        self.container.mux(self.stream.encode(None))  # Flush buffered frames
+        self.container.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            # Don't flush after a failed write; a second error would mask the first
+            self.container.close()
+
 def save_mp3(signal, name):
-    wav_path = os.path.join(OUTPUT_DIR, f"{name}.wav")
     mp3_path = os.path.join(OUTPUT_DIR, f"{name}.mp3")
-    data = (signal * 32767).astype(np.int16)
-    wavfile.write(wav_path, SAMPLE_RATE, data)
-    subprocess.run([
-        "ffmpeg", "-y", "-i", wav_path, "-b:a", "128k", "-ar", "44100", mp3_path
-    ], capture_output=True)
-    os.remove(wav_path)
+    # Scale and round in place (signal is consumed) so the only new buffer is the int16 one
+    np.multiply(signal, 32767, out=signal)
+    np.rint(signal, out=signal)
+    data = signal.astype(np.int16)
+    with _Mp3Writer(mp3_path) as writer:
+        writer.write(data)
     print(f"  ✓ {name}.mp3 ({os.path.getsize(mp3_path)} bytes)")
 
 def tone(freq, duration_ms, volume=1.0):
-    t = np.linspace(0, duration_ms / 1000, int(SAMPLE_RATE * duration_ms / 1000), False)
-    return np.sin(2 * np.pi * freq * t) * volume
+    n = int(SAMPLE_RATE * duration_ms / 1000)
+    step = freq * SINE_LUT_SIZE / SAMPLE_RATE
+    idx = (np.arange(n, dtype=np.float64) * step).astype(np.int64) & (SINE_LUT_SIZE - 1)
+    return _SINE_LUT[idx] * volume
+
+def triangle(t, freq, floor=0.0):
+    """Triangle wave in [floor, 1] that starts at 0 and peaks mid-period.
+
+    A cheap stand-in for the raised cosine 0.5 - 0.5 * cos.
+    """
+    out = t * np.float32(freq)
+    np.mod(out, 1.0, out=out)
+    out -= 0.5
+    np.abs(out, out=out)
+    np.multiply(out, -2, out=out)
+    out += 1
+    np.maximum(out, floor, out=out)
+    return out
+
+def add_loop(signal, cycle):
+    """Add a periodic layer to signal by repeating one cycle of it end to end."""
+    for pos in range(0, len(signal), len(cycle)):
+        chunk = signal[pos:pos + len(cycle)]
+        chunk += cycle[:len(chunk)]
+
+def sequence(*parts):
+    """Lay parts end to end in one preallocated buffer.
+
+    An int part is a gap of that many silent samples.
+    """
+    lens = [p if isinstance(p, int) else len(p) for p in parts]
+    out = np.zeros(sum(lens), dtype=np.float32)
+    pos = 0
+    for p, n in zip(parts, lens):
+        if not isinstance(p, int):
+            out[pos:pos + n] = p
+        pos += n
+    return out
 
 def noise(duration_ms, volume=0.3):
     n = int(SAMPLE_RATE * duration_ms / 1000)
-    return np.random.randn(n) * volume
+    # A fresh OS-seeded generator per burst, so no two clips or workers share a stream
+    rng = np.random.default_rng()
+    return rng.standard_normal(n, dtype=np.float32) * np.float32(volume)
+
+_EMPTY = np.zeros(0, dtype=np.float32)
+_NO_PARTIALS = np.zeros(0)
+
+def pack_cycles(*cycles):
+    """Concatenate cycles into one buffer for synth_chord, plus bounds marking each one."""
+    bounds = np.zeros(len(cycles) + 1, dtype=np.int64)
+    bounds[1:] = np.cumsum([len(c) for c in cycles])
+    return (np.concatenate(cycles) if cycles else _EMPTY), bounds
+
+_NO_CYCLES = pack_cycles()
+
+# Compiled eagerly at import (or loaded from the on-disk cache) rather than on first call,
+# so no clip waits on the JIT. Keep it serial: a parallel=True kernel compiled here starts
+# Numba's threading layer at import, before the process pool is created
+@njit("void(float32[:], int64, int64, int64, float32[:], int64[:], float32[:], "
+      "float64[:], float64[:])", fastmath=True, cache=True)
+def synth_chord(out, start, seg_len, crossfade, cycles, bounds, gain, freqs, amps):
+    """Accumulate one chord segment into out[start:start + seg_len] in a single pass.
+
+    Each sample is the sum of the packed cycles (each tiled independently) plus a
+    sum of sine partials, scaled by gain (tiled) and by a linear fade over the first
+    and last crossfade samples. No cycles, an empty gain and crossfade=0 disable
+    those terms.
+    """
+    nc = len(bounds) - 1
+    ng = len(gain)
+    ramp = max(crossfade - 1, 1)
+    fades = crossfade > 0 and crossfade < seg_len
+    for i in range(seg_len):
+        tt = i / SAMPLE_RATE
+        acc = 0.0
+        for v in range(nc):
+            lo = bounds[v]
+            acc += cycles[lo + i % (bounds[v + 1] - lo)]
+        for k in range(len(freqs)):
+            acc += amps[k] * math.sin(2 * math.pi * freqs[k] * tt)
+        if ng > 0:
+            acc *= gain[i % ng]
+        if fades:
+            if i >= seg_len - crossfade:
+                acc *= (seg_len - 1 - i) / ramp
+            elif i < crossfade:
+                acc *= i / ramp
+        out[start + i] += acc
+
+def add_chord(signal, start, seg_len, crossfade, freqs, amps, gain=_EMPTY):
+    """Add a crossfaded chord of sine partials to signal[start:start + seg_len].
+
+    Integer-Hz partials repeat exactly every SAMPLE_RATE samples, so they are
+    synthesized for one second and tiled; only detuned partials run the full length.
+    """
+    periodic = freqs == np.round(freqs)
+    cycles, bounds = _NO_CYCLES
+    if periodic.any():
+        base = np.zeros(SAMPLE_RATE, dtype=np.float32)
+        synth_chord(base, 0, SAMPLE_RATE, 0, *_NO_CYCLES, _EMPTY,
+                    freqs[periodic], amps[periodic])
+        cycles, bounds = pack_cycles(base)
+    synth_chord(signal, start, seg_len, crossfade, cycles, bounds, gain,
+                freqs[~periodic], amps[~periodic])
+
+def impulse_cycle(freq, amp):
+    """One steady-state period of an impulse train at freq through the pad filter.
+
+    The cycle is scaled to peak amp, and its period is rounded to whole samples so
+    it tiles exactly. The train runs for 0.1 s first so the filter has settled
+    before the cycle is taken.
+    """
+    period = round(SAMPLE_RATE / freq)
+    settle = -(-SAMPLE_RATE // 10 // period)
+    impulse = np.zeros((settle + 1) * period)
+    impulse[::period] = 1
+    impulse -= 1 / period  # Zero mean, so the integrator doesn't drift
+    return normalize(sosfilt(_PAD_SOS, impulse)[-period:].astype(np.float32), amp)
 
 # --- Sound Effects ---
 
@@ -59,17 +247,17 @@ def gen_capture():
     t1 = tone(330, 120, 0.5)
     t2 = tone(165, 120, 0.3)
     # Combine: sharp initial noise + dual tone
-    padded_noise = np.concatenate([n, np.zeros(int(SAMPLE_RATE * 70 / 1000))])
-    combined = padded_noise[:len(t1)] + t1 + t2
+    combined = t1 + t2
+    combined[:len(n)] += n
     signal = fade(combined, 2, 60)
     save_mp3(normalize(signal, 0.6), "capture")
 
 def gen_check():
     """Alert tone — ascending two-note."""
     t1 = tone(523, 100, 0.6)  # C5
-    gap = np.zeros(int(SAMPLE_RATE * 30 / 1000))
+    gap = int(SAMPLE_RATE * 30 / 1000)
     t2 = tone(659, 120, 0.6)  # E5
-    signal = np.concatenate([t1, gap, t2])
+    signal = sequence(t1, gap, t2)
     signal = fade(signal, 5, 60)
     save_mp3(normalize(signal, 0.5), "check")
 
@@ -78,17 +266,17 @@ def gen_checkmate():
     t1 = tone(523, 150, 0.6)  # C5
     t2 = tone(659, 150, 0.6)  # E5
     t3 = tone(784, 300, 0.7)  # G5
-    gap = np.zeros(int(SAMPLE_RATE * 40 / 1000))
-    signal = np.concatenate([t1, gap, t2, gap, t3])
+    gap = int(SAMPLE_RATE * 40 / 1000)
+    signal = sequence(t1, gap, t2, gap, t3)
     signal = fade(signal, 5, 100)
     save_mp3(normalize(signal, 0.6), "checkmate")
 
 def gen_castle():
     """Double tap — two piece movements."""
     tap1 = noise(60, 0.5) + tone(200, 60, 0.3)
-    gap = np.zeros(int(SAMPLE_RATE * 100 / 1000))
+    gap = int(SAMPLE_RATE * 100 / 1000)
     tap2 = noise(60, 0.5) + tone(240, 60, 0.3)
-    signal = np.concatenate([fade(tap1, 2, 30), gap, fade(tap2, 2, 30)])
+    signal = sequence(fade(tap1, 2, 30), gap, fade(tap2, 2, 30))
     save_mp3(normalize(signal, 0.5), "castle")
 
 def gen_illegal():
@@ -100,9 +288,9 @@ def gen_illegal():
 def gen_undo():
     """Descending two-note — reversal."""
     t1 = tone(440, 80, 0.5)   # A4
-    gap = np.zeros(int(SAMPLE_RATE * 30 / 1000))
+    gap = int(SAMPLE_RATE * 30 / 1000)
     t2 = tone(330, 100, 0.5)  # E4
-    signal = np.concatenate([t1, gap, t2])
+    signal = sequence(t1, gap, t2)
     signal = fade(signal, 5, 50)
     save_mp3(normalize(signal, 0.4), "undo")
 
@@ -115,8 +303,8 @@ def gen_game_start():
         t = fade(t, 3, 30)
         parts.append(t)
         if i < len(notes) - 1:
-            parts.append(np.zeros(int(SAMPLE_RATE * 50 / 1000)))
-    signal = np.concatenate(parts)
+            parts.append(int(SAMPLE_RATE * 50 / 1000))
+    signal = sequence(*parts)
     signal = fade(signal, 5, 80)
     save_mp3(normalize(signal, 0.45), "game-start")
 
@@ -124,8 +312,8 @@ def gen_draw():
     """Neutral ending — flat resolution."""
     t1 = tone(392, 200, 0.5)  # G4
     t2 = tone(349, 300, 0.5)  # F4
-    gap = np.zeros(int(SAMPLE_RATE * 50 / 1000))
-    signal = np.concatenate([t1, gap, t2])
+    gap = int(SAMPLE_RATE * 50 / 1000)
+    signal = sequence(t1, gap, t2)
     signal = fade(signal, 5, 120)
     save_mp3(normalize(signal, 0.4), "draw")
 
@@ -134,7 +322,7 @@ def gen_draw():
 def gen_music_calm():
     """Calm ambient loop — gentle pad with slow chord progression (~30 seconds)."""
     duration = 30.0
-    t = np.linspace(0, duration, int(SAMPLE_RATE * duration), False)
+    t = np.linspace(0, duration, int(SAMPLE_RATE * duration), False, dtype=np.float32)
     
     # Slow chord progression: Am -> F -> C -> G (each ~7.5 seconds)
     chords = [
@@ -150,34 +338,25 @@ def gen_music_calm():
     for i, (f1, f2, f3) in enumerate(chords):
         start = int(i * chord_len * SAMPLE_RATE)
         end = int((i + 1) * chord_len * SAMPLE_RATE)
-        seg_t = t[start:end] - t[start]
-        seg_len = len(seg_t)
-        
-        # Warm pad tones with slight detune for richness
-        pad = (np.sin(2 * np.pi * f1 * seg_t) * 0.25 +
-               np.sin(2 * np.pi * (f1 * 1.002) * seg_t) * 0.15 +
-               np.sin(2 * np.pi * f2 * seg_t) * 0.20 +
-               np.sin(2 * np.pi * (f2 * 0.998) * seg_t) * 0.12 +
-               np.sin(2 * np.pi * f3 * seg_t) * 0.15 +
-               np.sin(2 * np.pi * (f3 * 1.003) * seg_t) * 0.08)
-        
-        # Crossfade between chords
-        crossfade = int(SAMPLE_RATE * 0.8)
-        envelope = np.ones(seg_len)
-        if crossfade < seg_len:
-            envelope[:crossfade] = np.linspace(0, 1, crossfade)
-            envelope[-crossfade:] = np.linspace(1, 0, crossfade)
+        seg_len = end - start
         
-        signal[start:end] += pad * envelope
+        # Warm filtered voices, crossfaded between chords
+        cycles, bounds = pack_cycles(impulse_cycle(f1, 0.40),
+                                     impulse_cycle(f2, 0.32),
+                                     impulse_cycle(f3, 0.23))
+        synth_chord(signal, start, seg_len, int(SAMPLE_RATE * 0.8), cycles, bounds,
+                    _EMPTY, _NO_PARTIALS, _NO_PARTIALS)
     
-    # Add very subtle high shimmer
-    shimmer = np.sin(2 * np.pi * 880 * t) * 0.02 * (1 + np.sin(2 * np.pi * 0.1 * t)) * 0.5
-    signal += shimmer
+    # Add very subtle high shimmer (repeats every 10 s, so one cycle is looped)
+    cycle = t[:SAMPLE_RATE * 10]
+    add_loop(signal, ne.evaluate("sin(w * t) * 0.02 * (1 + sin(wm * t)) * 0.5",
+                                 local_dict={"t": cycle, "w": np.float32(2 * np.pi * 880),
+                                             "wm": np.float32(2 * np.pi * 0.1)}))
     
     # Gentle loop fade
     loop_fade = int(SAMPLE_RATE * 2)
-    signal[:loop_fade] *= np.linspace(0, 1, loop_fade)
-    signal[-loop_fade:] *= np.linspace(1, 0, loop_fade)
+    np.multiply(signal[:loop_fade], _ramp(loop_fade, True), out=signal[:loop_fade])
+    np.multiply(signal[-loop_fade:], _ramp(loop_fade, False), out=signal[-loop_fade:])
     
     save_mp3(normalize(signal, 0.35), "music-calm")
 
@@ -186,7 +365,7 @@ def gen_music_upbeat():
     duration = 30.0
     bpm = 120
     beat_duration = 60.0 / bpm
-    t = np.linspace(0, duration, int(SAMPLE_RATE * duration), False)
+    t = np.linspace(0, duration, int(SAMPLE_RATE * duration), False, dtype=np.float32)
     
     signal = np.zeros_like(t)
     
@@ -200,62 +379,67 @@ def gen_music_upbeat():
     
     chord_len = duration / len(chords)
     
+    # Rhythmic pulse (eighth notes); a whole number of them fit in a second,
+    # so one second of it is tiled across every chord
+    pulse_freq = 1.0 / (beat_duration / 2)
+    pulse = triangle(t[:SAMPLE_RATE], pulse_freq, 0.3)
+    
     for i, (f1, f2, f3) in enumerate(chords):
         start = int(i * chord_len * SAMPLE_RATE)
         end = int((i + 1) * chord_len * SAMPLE_RATE)
-        seg_t = t[start:end] - t[start]
-        seg_len = len(seg_t)
-        
-        # Brighter, more present tones
-        pad = (np.sin(2 * np.pi * f1 * seg_t) * 0.2 +
-               np.sin(2 * np.pi * f2 * seg_t) * 0.2 +
-               np.sin(2 * np.pi * f3 * seg_t) * 0.15 +
-               np.sin(2 * np.pi * (f1 * 2) * seg_t) * 0.08)  # Octave up
+        seg_len = end - start
         
-        # Rhythmic pulse (eighth notes)
-        pulse_freq = 1.0 / (beat_duration / 2)
-        pulse = 0.5 + 0.5 * np.sin(2 * np.pi * pulse_freq * seg_t - np.pi / 2)
-        pulse = np.clip(pulse, 0.3, 1.0)
-        
-        envelope = np.ones(seg_len)
-        crossfade = int(SAMPLE_RATE * 0.3)
-        if crossfade < seg_len:
-            envelope[:crossfade] = np.linspace(0, 1, crossfade)
-            envelope[-crossfade:] = np.linspace(1, 0, crossfade)
-        
-        signal[start:end] += pad * pulse * envelope
+        # Brighter, more present tones (last partial is an octave up)
+        add_chord(signal, start, seg_len, int(SAMPLE_RATE * 0.3),
+                  np.array([f1, f2, f3, f1 * 2], dtype=np.float64),
+                  np.array([0.2, 0.2, 0.15, 0.08]),
+                  gain=pulse)
     
     # Add rhythmic bass pulse
+    # (65 Hz gated on each beat repeats every second, so one cycle is looped)
     bass_freq = 2.0 / beat_duration  # Hits on each beat
-    bass_envelope = np.clip(0.5 + 0.5 * np.sin(2 * np.pi * bass_freq * t - np.pi / 2), 0, 1)
-    bass = np.sin(2 * np.pi * 65 * t) * 0.15 * bass_envelope  # Low C
-    signal += bass
+    cycle = t[:SAMPLE_RATE]
+    add_loop(signal, ne.evaluate("sin(w * t) * 0.15 * env",  # Low C
+                                 local_dict={"t": cycle, "w": np.float32(2 * np.pi * 65),
+                                             "env": triangle(cycle, bass_freq)}))
     
-    # Add higher energy shimmer
-    shimmer = np.sin(2 * np.pi * 1047 * t) * 0.03 * (1 + np.sin(2 * np.pi * 0.5 * t)) * 0.5
-    signal += shimmer
+    # Add higher energy shimmer (repeats every 2 s)
+    cycle = t[:SAMPLE_RATE * 2]
+    add_loop(signal, ne.evaluate("sin(w * t) * 0.03 * (1 + sin(wm * t)) * 0.5",
+                                 local_dict={"t": cycle, "w": np.float32(2 * np.pi * 1047),
+                                             "wm": np.float32(2 * np.pi * 0.5)}))
     
     # Loop fade
     loop_fade = int(SAMPLE_RATE * 1.5)
-    signal[:loop_fade] *= np.linspace(0, 1, loop_fade)
-    signal[-loop_fade:] *= np.linspace(1, 0, loop_fade)
+    np.multiply(signal[:loop_fade], _ramp(loop_fade, True), out=signal[:loop_fade])
+    np.multiply(signal[-loop_fade:], _ramp(loop_fade, False), out=signal[-loop_fade:])
     
     save_mp3(normalize(signal, 0.35), "music-upbeat")
 
 
+GENERATORS = [
+    gen_move,
+    gen_capture,
+    gen_check,
+    gen_checkmate,
+    gen_castle,
+    gen_illegal,
+    gen_undo,
+    gen_game_start,
+    gen_draw,
+    gen_music_calm,
+    gen_music_upbeat,
+]
+
+
 if __name__ == "__main__":
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    print("Generating sound effects...")
-    gen_move()
-    gen_capture()
-    gen_check()
-    gen_checkmate()
-    gen_castle()
-    gen_illegal()
-    gen_undo()
-    gen_game_start()
-    gen_draw()
-    print("\nGenerating background music...")
-    gen_music_calm()
-    gen_music_upbeat()
+    print("Generating sound effects and background music...")
+    # Clips are independent, so synthesize and encode them all concurrently. Workers are
+    # spawned fresh rather than forked, so they inherit no thread pools (Numba, numexpr)
+    # from this process; still, start no threads before this point. Each noise() call
+    # builds its own generator, so no random stream is shared between clips.
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as ex:
+        for future in [ex.submit(gen) for gen in GENERATORS]:
+            future.result()
     print("\nDone! All files in:", OUTPUT_DIR)